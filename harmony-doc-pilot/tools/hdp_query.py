@@ -3,15 +3,24 @@
 from __future__ import annotations
 
 import argparse
+import bisect
+import functools
 import json
 import os
 import re
 import sqlite3
 import subprocess
+import sys
 import time
+from dataclasses import dataclass
 from pathlib import Path
 from typing import Dict, Iterable, List, Optional, Tuple
 
+try:
+    import orjson  # type: ignore
+except Exception:  # pragma: no cover
+    orjson = None
+
 from hdp_utils import (
     extract_summary,
     load_config,
@@ -58,14 +67,29 @@ _STOPWORDS = {
 }
 
 
+_TOKEN_RE = re.compile(r"[A-Za-z_][\w]*|[\u4e00-\u9fff]{1,4}")
+
+
 def _db_path() -> str:
     base_dir = Path(__file__).resolve().parent.parent
     data_dir = base_dir / "data"
     return str((data_dir / "catalog.sqlite").resolve())
 
 
-def _tokenize(q: str) -> List[str]:
-    tokens = re.findall(r"[A-Za-z_][\w]*|[\u4e00-\u9fff]{1,4}", q)
+@functools.lru_cache(maxsize=1)
+def _get_conn() -> sqlite3.Connection:
+    # One connection per process; --serve reuses it across requests.
+    conn = sqlite3.connect(_db_path())
+    conn.execute("PRAGMA mmap_size=268435456")
+    conn.execute("PRAGMA cache_size=-65536")
+    conn.execute("PRAGMA temp_store=MEMORY")
+    conn.execute("PRAGMA journal_mode=WAL")
+    return conn
+
+
+@functools.lru_cache(maxsize=1024)
+def _tokenize(q: str) -> Tuple[str, ...]:
+    tokens = _TOKEN_RE.findall(q)
     out = []
     for t in tokens:
         lt = t.lower()
@@ -74,24 +98,60 @@ def _tokenize(q: str) -> List[str]:
         if len(t) <= 1:
             continue
         out.append(t)
-    return list(dict.fromkeys(out))
+    return tuple(dict.fromkeys(out))
+
+
+def _fts_quote(keyword: str) -> str:
+    return '"' + keyword.replace('"', '""') + '"'
+
 
+@dataclass(frozen=True)
+class KeywordSet:
+    """Query keywords rendered once for the FTS, trigram/LIKE and rg paths."""
 
-def _fts_candidates(conn: sqlite3.Connection, keywords: List[str], topk: int) -> List[Dict]:
-    if not keywords:
+    keywords: Tuple[str, ...]
+    fts_expr: str
+    trigram_expr: str
+    like_json: str
+    rg_args: Tuple[str, ...]
+
+
+@functools.lru_cache(maxsize=1024)
+def _keyword_set(keywords: Tuple[str, ...]) -> KeywordSet:
+    keywords = keywords[:10]
+    # The trigram index only answers substrings of 3+ characters; shorter
+    # keywords (e.g. two-character Chinese words) are matched with LIKE.
+    long_kws = [k for k in keywords if len(k) >= 3]
+    short_kws = [k for k in keywords if len(k) < 3]
+    return KeywordSet(
+        keywords=keywords,
+        fts_expr=" OR ".join(_fts_quote(k) for k in keywords),
+        trigram_expr=" OR ".join(_fts_quote(k) for k in long_kws),
+        like_json=json.dumps(short_kws, ensure_ascii=False) if short_kws else "",
+        rg_args=tuple(arg for k in keywords for arg in ("-e", k)),
+    )
+
+
+def _fts_candidates(conn: sqlite3.Connection, kws: KeywordSet, topk: int) -> List[Dict]:
+    if not kws.keywords:
         return []
     cur = conn.cursor()
-    query = " OR ".join(keywords[:10])
     try:
         cur.execute(
             """
+            WITH fts AS (
+                SELECT rowid, bm25(symbols_fts) AS r
+                FROM symbols_fts
+                WHERE symbols_fts MATCH ?
+                ORDER BY r
+                LIMIT ?
+            )
             SELECT s.id, s.name, s.kind, s.path, s.section_id, s.line, s.summary, s.tags
-            FROM symbols_fts f
-            JOIN symbols s ON s.id = f.rowid
-            WHERE symbols_fts MATCH ?
-            LIMIT ?
+            FROM fts
+            JOIN symbols s ON s.id = fts.rowid
+            ORDER BY fts.r
             """,
-            (query, topk),
+            (kws.fts_expr, topk),
         )
         rows = cur.fetchall()
     except (sqlite3.OperationalError, sqlite3.DatabaseError):
@@ -112,23 +172,48 @@ def _fts_candidates(conn: sqlite3.Connection, keywords: List[str], topk: int) ->
     ]
 
 
-def _like_candidates(conn: sqlite3.Connection, keywords: List[str], topk: int) -> List[Dict]:
-    if not keywords:
+def _like_candidates(conn: sqlite3.Connection, kws: KeywordSet, topk: int) -> List[Dict]:
+    if not kws.keywords:
         return []
     cur = conn.cursor()
-    clauses = []
-    params: List[str] = []
-    for kw in keywords[:10]:
-        clauses.append("name LIKE ? OR summary LIKE ? OR tags LIKE ?")
-        params.extend([f"%{kw}%", f"%{kw}%", f"%{kw}%"])
-    sql = (
-        "SELECT id, name, kind, path, section_id, line, summary, tags FROM symbols WHERE "
-        + " OR ".join(clauses)
-        + " LIMIT ?"
-    )
-    params.append(str(topk))
-    cur.execute(sql, params)
-    rows = cur.fetchall()
+    like_json = kws.like_json
+    rows: List[Tuple] = []
+    if kws.trigram_expr:
+        try:
+            cur.execute(
+                """
+                WITH tri AS (
+                    SELECT rowid
+                    FROM symbols_fts_tri
+                    WHERE symbols_fts_tri MATCH ?
+                    LIMIT ?
+                )
+                SELECT s.id, s.name, s.kind, s.path, s.section_id, s.line, s.summary, s.tags
+                FROM tri
+                JOIN symbols s ON s.id = tri.rowid
+                """,
+                (kws.trigram_expr, topk),
+            )
+            rows = cur.fetchall()
+        except (sqlite3.OperationalError, sqlite3.DatabaseError):
+            like_json = json.dumps(list(kws.keywords), ensure_ascii=False)
+    if like_json and len(rows) < topk:
+        cur.execute(
+            """
+            SELECT id, name, kind, path, section_id, line, summary, tags
+            FROM symbols
+            WHERE EXISTS (
+                SELECT 1 FROM json_each(?)
+                WHERE name LIKE '%' || value || '%'
+                    OR summary LIKE '%' || value || '%'
+                    OR tags LIKE '%' || value || '%'
+            )
+            LIMIT ?
+            """,
+            (like_json, topk),
+        )
+        seen_ids = {r[0] for r in rows}
+        rows.extend(r for r in cur.fetchall() if r[0] not in seen_ids)
     return [
         {
             "id": r[0],
@@ -141,54 +226,50 @@ def _like_candidates(conn: sqlite3.Connection, keywords: List[str], topk: int) -
             "tags": r[7],
             "source": "catalog_like",
         }
-        for r in rows
+        for r in rows[:topk]
     ]
 
 
-def _rg_candidates(config: Dict, keywords: List[str]) -> List[Dict]:
-    if not keywords:
+def _rg_candidates(config: Dict, kws: KeywordSet) -> List[Dict]:
+    if not kws.keywords:
         return []
     root = Path(config["docs_root"]).resolve()
     include_scopes = [root / p for p in config.get("include_scopes", [])]
     exclude_scopes = config.get("exclude_scopes", [])
     text_exts = config.get("text_extensions", [])
     rg_conf = config.get("ripgrep", {})
-    context_lines = int(rg_conf.get("context_lines", 30))
     max_hits_per_file = int(rg_conf.get("max_hits_per_file", 20))
     max_files = int(rg_conf.get("max_files", 200))
 
-    pattern = "|".join(re.escape(k) for k in keywords[:10])
+    scopes = [str(scope) for scope in include_scopes if scope.exists()]
+    if not scopes:
+        return []
+
+    # One rg run over every scope (rg searches them in parallel itself);
+    # context records are not used, so no -C. --iglob keeps rg from opening
+    # images and other non-text files at all.
+    cmd = ["rg", "--json", "-F", "-m", str(max_hits_per_file)]
+    for ext in text_exts:
+        cmd.extend(["--iglob", f"*{ext}"])
+    cmd.extend([*kws.rg_args, *scopes])
+
     candidates: List[Dict] = []
     files_seen = set()
+    try:
+        proc = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, text=True, encoding="utf-8")
+    except FileNotFoundError:
+        return []
 
-    for scope in include_scopes:
-        if not scope.exists():
-            continue
-        cmd = [
-            "rg",
-            "-n",
-            "--no-heading",
-            "-m",
-            str(max_hits_per_file),
-            "-C",
-            str(context_lines),
-            pattern,
-            str(scope),
-        ]
-        try:
-            proc = subprocess.run(cmd, capture_output=True, text=True, check=False)
-        except FileNotFoundError:
-            return []
-        if proc.returncode not in (0, 1):
-            continue
-        lines = proc.stdout.splitlines()
-        for line in lines:
-            if not line or line.startswith("--"):
+    with proc:
+        for line in proc.stdout:
+            record = json.loads(line)
+            if record.get("type") != "match":
                 continue
-            m = re.match(r"^(.*?):(\d+):(.*)$", line)
-            if not m:
+            data = record["data"]
+            path = data["path"].get("text")
+            text = data["lines"].get("text")
+            if path is None or text is None:
                 continue
-            path = m.group(1)
             rel = Path(path).resolve().relative_to(root).as_posix()
             if any(rel.startswith(ex + "/") or rel == ex for ex in exclude_scopes):
                 continue
@@ -197,8 +278,9 @@ def _rg_candidates(config: Dict, keywords: List[str]) -> List[Dict]:
             if path not in files_seen:
                 files_seen.add(path)
                 if len(files_seen) > max_files:
+                    proc.kill()
                     break
-            candidates.append({"path": path, "line": int(m.group(2)), "text": m.group(3), "source": "rg"})
+            candidates.append({"path": path, "line": int(data["line_number"]), "text": text.rstrip("\r\n"), "source": "rg"})
 
     return candidates
 
@@ -216,6 +298,10 @@ def _ensure_catalog() -> None:
         if not row:
             conn.close()
             raise RuntimeError("catalog.sqlite 不完整，请先运行 tools/hdp_init.py 重新初始化索引")
+        cur.execute("PRAGMA table_info(sections)")
+        if "text" not in {r[1] for r in cur.fetchall()}:
+            conn.close()
+            raise RuntimeError("catalog.sqlite 版本过旧，请先运行 tools/hdp_init.py 更新索引")
         cur.execute("SELECT COUNT(1) FROM symbols")
         count = cur.fetchone()[0]
         conn.close()
@@ -228,7 +314,7 @@ def _ensure_catalog() -> None:
 def _load_sections_for_path(conn: sqlite3.Connection, path: str) -> List[Dict]:
     cur = conn.cursor()
     cur.execute(
-        "SELECT id, h1, h2, h3, start_line, end_line FROM sections WHERE path = ? ORDER BY start_line",
+        "SELECT id, h1, h2, h3, start_line, end_line, text FROM sections WHERE path = ? ORDER BY start_line",
         (path,),
     )
     rows = cur.fetchall()
@@ -240,26 +326,19 @@ def _load_sections_for_path(conn: sqlite3.Connection, path: str) -> List[Dict]:
             "h3": r[3],
             "start_line": r[4],
             "end_line": r[5],
+            "text": r[6],
         }
         for r in rows
     ]
 
 
-def _section_for_line(sections: List[Dict], line: int) -> Optional[Dict]:
-    for sec in sections:
-        if sec["start_line"] <= line <= sec["end_line"]:
-            return sec
-    return None
-
-
-def _merge_candidates(candidates: List[Dict]) -> List[Dict]:
-    seen = {}
-    for c in candidates:
-        key = (c.get("path"), c.get("section_id"), c.get("name"))
-        if key in seen:
-            continue
-        seen[key] = c
-    return list(seen.values())
+def _section_for_line(sections: List[Dict], starts: List[int], line: int) -> Optional[Dict]:
+    # `starts` mirrors `sections` (ordered by start_line). Sections nest, so step
+    # back from the latest start <= line to the innermost section spanning it.
+    i = bisect.bisect_right(starts, line) - 1
+    while i >= 0 and sections[i]["end_line"] < line:
+        i -= 1
+    return sections[i] if i >= 0 else None
 
 
 def _load_assets(conn: sqlite3.Connection, section_id: Optional[int]) -> List[Dict]:
@@ -273,35 +352,72 @@ def _load_assets(conn: sqlite3.Connection, section_id: Optional[int]) -> List[Di
     return [{"abs_path": r[0], "rel_path": r[1], "alt": r[2]} for r in cur.fetchall()]
 
 
-def query(config_path: str, q: str, topk: int, final: int, with_images: bool) -> Dict:
+def _cached_section_text(
+    lines_cache: Dict[str, List[str]],
+    text_cache: Dict[Tuple[str, int], str],
+    path: str,
+    sec: Dict,
+) -> str:
+    # Catalogs built before section text was stored fall back to the file.
+    if sec["text"] is not None:
+        return sec["text"]
+    key = (path, sec["id"])
+    text = text_cache.get(key)
+    if text is None:
+        lines = lines_cache.get(path)
+        if lines is None:
+            lines = lines_cache[path] = read_lines(path)
+        text = text_cache[key] = section_text(lines, sec["start_line"], sec["end_line"])
+    return text
+
+
+def query(
+    config_path: str,
+    q: str,
+    topk: int,
+    final: int,
+    with_images: bool,
+    conn: Optional[sqlite3.Connection] = None,
+) -> Dict:
     config = load_config(config_path)
     docs_root = norm_path(config["docs_root"])
-    _ensure_catalog()
+    if conn is None:
+        _ensure_catalog()
+        conn = _get_conn()
     keywords = _tokenize(q)
     start = time.time()
 
-    conn = sqlite3.connect(_db_path())
-
-    catalog_hits = _fts_candidates(conn, keywords, topk)
+    kws = _keyword_set(keywords)
+    catalog_hits = _fts_candidates(conn, kws, topk)
     if not catalog_hits:
-        catalog_hits = _like_candidates(conn, keywords, topk)
+        catalog_hits = _like_candidates(conn, kws, topk)
 
-    rg_hits = _rg_candidates(config, keywords)
+    rg_hits = _rg_candidates(config, kws)
 
-    evidence: List[Dict] = []
-    candidates: List[Dict] = []
-    assets: List[Dict] = []
+    # Keyed by their dedup identity so repeated hits merge on insert.
+    evidence: Dict[Tuple, Dict] = {}
+    candidates: Dict[Tuple, Dict] = {}
+    assets: Dict[Tuple, Dict] = {}
+
+    # Many hits land in the same file/section; load each only once per query.
+    sections_cache: Dict[str, Tuple[List[int], List[Dict]]] = {}
+    lines_cache: Dict[str, List[str]] = {}
+    text_cache: Dict[Tuple[str, int], str] = {}
 
     # Build candidates from catalog hits
     for hit in catalog_hits:
-        sections = _load_sections_for_path(conn, hit["path"])
+        cached = sections_cache.get(hit["path"])
+        if cached is None:
+            sections = _load_sections_for_path(conn, hit["path"])
+            cached = sections_cache[hit["path"]] = ([s["start_line"] for s in sections], sections)
+        starts, sections = cached
         sec = None
         for s in sections:
             if s["id"] == hit["section_id"]:
                 sec = s
                 break
         if sec is None:
-            sec = _section_for_line(sections, hit["line"])
+            sec = _section_for_line(sections, starts, hit["line"])
         section_id = sec["id"] if sec else None
 
         section_title = {
@@ -310,7 +426,8 @@ def query(config_path: str, q: str, topk: int, final: int, with_images: bool) ->
             "h3": sec["h3"] if sec else None,
         }
 
-        candidates.append(
+        candidates.setdefault(
+            (hit["path"], section_id, hit["name"]),
             {
                 "name": hit["name"],
                 "kind": hit["kind"],
@@ -320,28 +437,30 @@ def query(config_path: str, q: str, topk: int, final: int, with_images: bool) ->
                 "summary": hit.get("summary") or "",
                 "score_hint": 50,
                 "source": hit["source"],
-            }
+            },
         )
 
-        if sec:
-            lines = read_lines(hit["path"])
-            text = section_text(lines, sec["start_line"], sec["end_line"])
-            evidence.append(
-                {
-                    "path": hit["path"],
-                    "start_line": sec["start_line"],
-                    "end_line": sec["end_line"],
-                    "text": text,
-                    "section_id": sec["id"],
-                }
-            )
+        if sec and (hit["path"], sec["id"]) not in evidence:
+            text = _cached_section_text(lines_cache, text_cache, hit["path"], sec)
+            evidence[(hit["path"], sec["id"])] = {
+                "path": hit["path"],
+                "start_line": sec["start_line"],
+                "end_line": sec["end_line"],
+                "text": text,
+                "section_id": sec["id"],
+            }
             if with_images:
-                assets.extend(_load_assets(conn, sec["id"]))
+                for a in _load_assets(conn, sec["id"]):
+                    assets.setdefault((a["abs_path"], a["rel_path"]), a)
 
     # Build candidates from rg hits
     for hit in rg_hits:
-        sections = _load_sections_for_path(conn, hit["path"])
-        sec = _section_for_line(sections, hit["line"])
+        cached = sections_cache.get(hit["path"])
+        if cached is None:
+            sections = _load_sections_for_path(conn, hit["path"])
+            cached = sections_cache[hit["path"]] = ([s["start_line"] for s in sections], sections)
+        starts, sections = cached
+        sec = _section_for_line(sections, starts, hit["line"])
         section_id = sec["id"] if sec else None
         section_title = {
             "h1": sec["h1"] if sec else None,
@@ -349,7 +468,8 @@ def query(config_path: str, q: str, topk: int, final: int, with_images: bool) ->
             "h3": sec["h3"] if sec else None,
         }
         name = hit["text"].strip()[:80]
-        candidates.append(
+        candidates.setdefault(
+            (hit["path"], section_id, name),
             {
                 "name": name,
                 "kind": "snippet",
@@ -359,50 +479,30 @@ def query(config_path: str, q: str, topk: int, final: int, with_images: bool) ->
                 "summary": "",
                 "score_hint": 30,
                 "source": "rg",
-            }
+            },
         )
-        if sec:
-            lines = read_lines(hit["path"])
-            text = section_text(lines, sec["start_line"], sec["end_line"])
-            evidence.append(
-                {
-                    "path": hit["path"],
-                    "start_line": sec["start_line"],
-                    "end_line": sec["end_line"],
-                    "text": text,
-                    "section_id": sec["id"],
-                }
-            )
+        if sec and (hit["path"], sec["id"]) not in evidence:
+            text = _cached_section_text(lines_cache, text_cache, hit["path"], sec)
+            evidence[(hit["path"], sec["id"])] = {
+                "path": hit["path"],
+                "start_line": sec["start_line"],
+                "end_line": sec["end_line"],
+                "text": text,
+                "section_id": sec["id"],
+            }
             if with_images:
-                assets.extend(_load_assets(conn, sec["id"]))
-
-    merged = _merge_candidates(candidates)
+                for a in _load_assets(conn, sec["id"]):
+                    assets.setdefault((a["abs_path"], a["rel_path"]), a)
 
-    # Deduplicate evidence by section_id
-    seen_evidence = set()
-    uniq_evidence = []
-    for e in evidence:
-        key = (e["path"], e["section_id"])
-        if key in seen_evidence:
-            continue
-        seen_evidence.add(key)
-        uniq_evidence.append(e)
-
-    # Deduplicate assets
-    seen_assets = set()
-    uniq_assets = []
-    for a in assets:
-        key = (a["abs_path"], a.get("rel_path"))
-        if key in seen_assets:
-            continue
-        seen_assets.add(key)
-        uniq_assets.append(a)
+    merged = list(candidates.values())
+    uniq_evidence = list(evidence.values())
+    uniq_assets = list(assets.values())
 
     elapsed = int((time.time() - start) * 1000)
     result = {
         "meta": {
             "query": q,
-            "keywords": keywords,
+            "keywords": list(keywords),
             "docs_root": docs_root,
             "include_scopes": config.get("include_scopes", []),
             "exclude_scopes": config.get("exclude_scopes", []),
@@ -418,21 +518,65 @@ def query(config_path: str, q: str, topk: int, final: int, with_images: bool) ->
             "final_candidates": min(len(merged), topk),
         },
     }
-    conn.close()
     return result
 
 
+def _write_json(result: Dict, indent: bool) -> None:
+    # orjson encodes straight to UTF-8 bytes; stdlib json is the fallback.
+    if orjson is not None:
+        option = orjson.OPT_NON_STR_KEYS | (orjson.OPT_INDENT_2 if indent else 0)
+        sys.stdout.buffer.write(orjson.dumps(result, option=option) + b"\n")
+    else:
+        sys.stdout.write(json.dumps(result, ensure_ascii=False, indent=2 if indent else None) + "\n")
+    sys.stdout.flush()
+
+
+def serve(config_path: str, topk: int, final: int, with_images: bool) -> None:
+    """Answer one JSON request per stdin line, reusing the catalog connection.
+
+    Each line is an object with ``q`` and optionally ``topk``, ``final`` and
+    ``with_images``; one compact JSON result is written per line.
+    """
+    _ensure_catalog()
+    conn = _get_conn()
+    for line in sys.stdin:
+        if not line.strip():
+            continue
+        try:
+            req = json.loads(line)
+            if not isinstance(req, dict) or not isinstance(req.get("q"), str):
+                raise ValueError('request must be a JSON object with a string "q"')
+            result = query(
+                config_path,
+                req["q"],
+                int(req.get("topk", topk)),
+                int(req.get("final", final)),
+                bool(req.get("with_images", with_images)),
+                conn=conn,
+            )
+        except (KeyError, TypeError, ValueError, RuntimeError, sqlite3.Error) as exc:
+            result = {"error": str(exc)}
+        _write_json(result, indent=False)
+
+
 def main() -> None:
     parser = argparse.ArgumentParser()
     parser.add_argument("--config", required=True)
-    parser.add_argument("--q", required=True)
+    parser.add_argument("--q")
     parser.add_argument("--topk", type=int, default=25)
     parser.add_argument("--final", type=int, default=6)
     parser.add_argument("--with-images", action="store_true")
+    parser.add_argument("--serve", action="store_true", help="read JSON requests from stdin, one per line")
     args = parser.parse_args()
 
+    if args.serve:
+        serve(args.config, args.topk, args.final, args.with_images)
+        return
+    if args.q is None:
+        parser.error("--q is required unless --serve is given")
+
     result = query(args.config, args.q, args.topk, args.final, args.with_images)
-    print(json.dumps(result, ensure_ascii=False, indent=2))
+    _write_json(result, indent=True)
 
 
 if __name__ == "__main__":
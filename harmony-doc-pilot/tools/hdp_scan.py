@@ -3,9 +3,11 @@
 from __future__ import annotations
 
 import argparse
+import bisect
 import os
 import sqlite3
 import time
+from concurrent.futures import ProcessPoolExecutor
 from pathlib import Path
 from typing import Dict, List, Optional, Tuple
 
@@ -14,16 +16,15 @@ from hdp_utils import (
     Section,
     Symbol,
     build_abs_path,
-    extract_assets,
     extract_summary,
-    extract_symbols,
-    file_sha1,
+    file_digest,
     iter_text_files,
     load_config,
     norm_path,
-    parse_sections,
+    parse_file_contents,
     read_lines,
     rel_to_root,
+    section_text,
 )
 
 
@@ -41,10 +42,19 @@ def _init_db(conn: sqlite3.Connection) -> None:
         CREATE TABLE IF NOT EXISTS files (
             path TEXT PRIMARY KEY,
             mtime REAL,
-            sha1 TEXT
+            digest TEXT,
+            size INTEGER
         )
         """
     )
+    try:
+        cur.execute("ALTER TABLE files RENAME COLUMN sha1 TO digest")
+    except sqlite3.OperationalError:
+        pass
+    try:
+        cur.execute("ALTER TABLE files ADD COLUMN size INTEGER")
+    except sqlite3.OperationalError:
+        pass
     cur.execute(
         """
         CREATE TABLE IF NOT EXISTS sections (
@@ -54,10 +64,15 @@ def _init_db(conn: sqlite3.Connection) -> None:
             h2 TEXT,
             h3 TEXT,
             start_line INTEGER,
-            end_line INTEGER
+            end_line INTEGER,
+            text TEXT
         )
         """
     )
+    try:
+        cur.execute("ALTER TABLE sections ADD COLUMN text TEXT")
+    except sqlite3.OperationalError:
+        pass
     cur.execute(
         """
         CREATE TABLE IF NOT EXISTS symbols (
@@ -98,16 +113,25 @@ def _init_db(conn: sqlite3.Connection) -> None:
         )
     except sqlite3.OperationalError:
         pass
+    try:
+        cur.execute(
+            """
+            CREATE VIRTUAL TABLE IF NOT EXISTS symbols_fts_tri
+            USING fts5(name, summary, tags, content='symbols', content_rowid='id', tokenize='trigram')
+            """
+        )
+    except sqlite3.OperationalError:
+        pass
     conn.commit()
 
 
-def _load_prev_file(conn: sqlite3.Connection, path: str) -> Optional[Tuple[float, str]]:
+def _load_prev_file(conn: sqlite3.Connection, path: str) -> Optional[Tuple[float, str, Optional[int]]]:
     cur = conn.cursor()
-    cur.execute("SELECT mtime, sha1 FROM files WHERE path = ?", (path,))
+    cur.execute("SELECT mtime, digest, size FROM files WHERE path = ?", (path,))
     row = cur.fetchone()
     if not row:
         return None
-    return float(row[0]), str(row[1])
+    return float(row[0]), str(row[1]), row[2]
 
 
 def _delete_by_path(conn: sqlite3.Connection, path: str) -> None:
@@ -117,79 +141,107 @@ def _delete_by_path(conn: sqlite3.Connection, path: str) -> None:
     cur.execute("DELETE FROM assets WHERE owner_path = ?", (path,))
 
 
-def _insert_sections(conn: sqlite3.Connection, sections: List[Section], lines: List[str]) -> List[Tuple[int, Section, str]]:
+def _insert_sections(conn: sqlite3.Connection, sections: List[Section], bodies: List[Tuple[str, str]]) -> List[Tuple[int, Section, str]]:
+    if not sections:
+        return []
     cur = conn.cursor()
-    result: List[Tuple[int, Section, str]] = []
-    for sec in sections:
-        summary = extract_summary(lines, sec.start_line, sec.end_line)
-        cur.execute(
-            """
-            INSERT INTO sections(path, h1, h2, h3, start_line, end_line)
-            VALUES (?, ?, ?, ?, ?, ?)
-            """,
-            (sec.path, sec.h1, sec.h2, sec.h3, sec.start_line, sec.end_line),
-        )
-        result.append((cur.lastrowid, sec, summary))
-    return result
-
-
-def _find_section_id(section_rows: List[Tuple[int, Section, str]], line: int) -> Tuple[Optional[int], str]:
-    matched: List[Tuple[int, Section, str]] = [r for r in section_rows if r[1].start_line <= line <= r[1].end_line]
-    if not matched:
+    cur.executemany(
+        """
+        INSERT INTO sections(path, h1, h2, h3, start_line, end_line, text)
+        VALUES (?, ?, ?, ?, ?, ?, ?)
+        """,
+        [
+            (sec.path, sec.h1, sec.h2, sec.h3, sec.start_line, sec.end_line, text)
+            for sec, (text, _) in zip(sections, bodies)
+        ],
+    )
+    # executemany() does not report per-row ids; a section is unique by its
+    # heading line within a file, so read the ids back in one query.
+    cur.execute("SELECT start_line, id FROM sections WHERE path = ?", (sections[0].path,))
+    ids = dict(cur.fetchall())
+    return [(ids[sec.start_line], sec, summary) for sec, (_, summary) in zip(sections, bodies)]
+
+
+def _find_section_id(section_rows: List[Tuple[int, Section, str]], starts: List[int], line: int) -> Tuple[Optional[int], str]:
+    # `section_rows` is ordered by start_line and `starts` mirrors it. Sections
+    # nest, so the innermost match is the latest start <= line that still spans it.
+    i = bisect.bisect_right(starts, line) - 1
+    while i >= 0 and section_rows[i][1].end_line < line:
+        i -= 1
+    if i < 0:
         return None, ""
-    matched.sort(key=lambda r: (r[1].start_line, r[1].end_line), reverse=True)
-    return matched[0][0], matched[0][2]
+    return section_rows[i][0], section_rows[i][2]
 
 
-def _insert_symbols(conn: sqlite3.Connection, symbols: List[Symbol], section_rows: List[Tuple[int, Section, str]], tags: str, path: str) -> int:
-    cur = conn.cursor()
+def _insert_symbols(conn: sqlite3.Connection, symbols: List[Symbol], section_rows: List[Tuple[int, Section, str]], starts: List[int], tags: str, path: str) -> int:
     seen = set()
-    count = 0
+    rows: List[Tuple] = []
     for sym in symbols:
         key = (sym.name, sym.kind, sym.line)
         if key in seen:
             continue
         seen.add(key)
-        section_id, summary = _find_section_id(section_rows, sym.line)
-        cur.execute(
-            """
-            INSERT INTO symbols(name, kind, path, section_id, line, tags, summary)
-            VALUES (?, ?, ?, ?, ?, ?, ?)
-            """,
-            (sym.name, sym.kind, path, section_id, sym.line, tags, summary),
-        )
-        count += 1
-    return count
+        section_id, summary = _find_section_id(section_rows, starts, sym.line)
+        rows.append((sym.name, sym.kind, path, section_id, sym.line, tags, summary))
+    conn.executemany(
+        """
+        INSERT INTO symbols(name, kind, path, section_id, line, tags, summary)
+        VALUES (?, ?, ?, ?, ?, ?, ?)
+        """,
+        rows,
+    )
+    return len(rows)
 
 
-def _insert_assets(conn: sqlite3.Connection, assets: List[Asset], section_rows: List[Tuple[int, Section, str]], owner_path: str, docs_root: str) -> int:
-    cur = conn.cursor()
-    count = 0
+def _insert_assets(conn: sqlite3.Connection, assets: List[Asset], section_rows: List[Tuple[int, Section, str]], starts: List[int], owner_path: str, docs_root: str) -> int:
+    rows: List[Tuple] = []
     for asset in assets:
         rel = asset.rel_path
         if rel.startswith("http://") or rel.startswith("https://"):
             continue
         abs_path = build_abs_path(str(Path(owner_path).parent), rel)
-        section_id, _ = _find_section_id(section_rows, asset.line)
-        cur.execute(
-            """
-            INSERT INTO assets(path, owner_path, section_id, alt, rel_path, line)
-            VALUES (?, ?, ?, ?, ?, ?)
-            """,
-            (abs_path, owner_path, section_id, asset.alt, rel, asset.line),
-        )
-        count += 1
-    return count
+        section_id, _ = _find_section_id(section_rows, starts, asset.line)
+        rows.append((abs_path, owner_path, section_id, asset.alt, rel, asset.line))
+    conn.executemany(
+        """
+        INSERT INTO assets(path, owner_path, section_id, alt, rel_path, line)
+        VALUES (?, ?, ?, ?, ?, ?)
+        """,
+        rows,
+    )
+    return len(rows)
 
 
 def _rebuild_fts(conn: sqlite3.Connection) -> None:
     cur = conn.cursor()
-    try:
-        cur.execute("DELETE FROM symbols_fts")
-        cur.execute("INSERT INTO symbols_fts(rowid, name, summary, tags) SELECT id, name, summary, tags FROM symbols")
-        conn.commit()
-    except (sqlite3.OperationalError, sqlite3.DatabaseError):
-        pass
+    for table in ("symbols_fts", "symbols_fts_tri"):
+        try:
+            # External-content tables must be rebuilt from `symbols`; a plain
+            # DELETE reads stale content and fails once symbols have changed.
+            cur.execute(f"INSERT INTO {table}({table}) VALUES ('rebuild')")
+        except (sqlite3.OperationalError, sqlite3.DatabaseError):
+            pass
+
+
+def parse_file(
+    path: str,
+) -> Tuple[str, float, int, str, List[Section], List[Tuple[str, str]], List[Symbol], List[Asset]]:
+    """Hash and parse one file; runs in a worker process, so no DB access here.
+
+    Section text and summaries are built here too, so only per-section
+    results (not the whole file's lines) are sent back to the parent.
+    """
+    st = os.stat(path)
+    digest = file_digest(path)
+    lines = read_lines(path)
+    sections, symbols, assets = parse_file_contents(path, lines)
+    if not sections:
+        sections = [Section(path=path, h1=None, h2=None, h3=None, start_line=1, end_line=len(lines))]
+    bodies = [
+        (section_text(lines, sec.start_line, sec.end_line), extract_summary(lines, sec.start_line, sec.end_line))
+        for sec in sections
+    ]
+    return path, st.st_mtime, st.st_size, digest, sections, bodies, symbols, assets
 
 
 def scan(config_path: str) -> None:
@@ -197,7 +249,13 @@ def scan(config_path: str) -> None:
     docs_root = norm_path(config["docs_root"])
 
     conn = sqlite3.connect(_db_path())
+    conn.execute("PRAGMA mmap_size=268435456")
+    conn.execute("PRAGMA cache_size=-65536")
+    conn.execute("PRAGMA temp_store=MEMORY")
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA synchronous=NORMAL")
     _init_db(conn)
+    conn.execute("BEGIN")
 
     start = time.time()
     files = list(iter_text_files(config))
@@ -207,37 +265,41 @@ def scan(config_path: str) -> None:
     symbols_count = 0
     assets_count = 0
 
+    to_process: List[str] = []
     for file_path in files:
         abs_path = norm_path(file_path)
-        mtime = os.path.getmtime(abs_path)
-        sha1 = file_sha1(abs_path)
         prev = _load_prev_file(conn, abs_path)
-        if prev and prev[0] == mtime and prev[1] == sha1:
+        st = os.stat(abs_path)
+        if prev and prev[0] == st.st_mtime and prev[2] == st.st_size:
             skipped += 1
             continue
-
-        _delete_by_path(conn, abs_path)
-
-        lines = read_lines(abs_path)
-        sections = parse_sections(abs_path, lines)
-        if not sections:
-            sections = [Section(path=abs_path, h1=None, h2=None, h3=None, start_line=1, end_line=len(lines))]
-        section_rows = _insert_sections(conn, sections, lines)
-
-        symbols = extract_symbols(lines)
-        assets = extract_assets(lines)
-        rel = rel_to_root(abs_path, docs_root)
-        tags = ",".join(Path(rel).parts[:3])
-
-        symbols_count += _insert_symbols(conn, symbols, section_rows, tags, abs_path)
-        assets_count += _insert_assets(conn, assets, section_rows, abs_path, docs_root)
-
-        conn.execute(
-            "INSERT OR REPLACE INTO files(path, mtime, sha1) VALUES (?, ?, ?)",
-            (abs_path, mtime, sha1),
-        )
-        updated += 1
-        sections_count += len(sections)
+        to_process.append(abs_path)
+
+    with ProcessPoolExecutor() as ex:
+        for abs_path, mtime, size, digest, sections, bodies, symbols, assets in ex.map(parse_file, to_process, chunksize=16):
+            prev = _load_prev_file(conn, abs_path)
+            if prev and prev[1] == digest:
+                conn.execute("UPDATE files SET mtime = ?, size = ? WHERE path = ?", (mtime, size, abs_path))
+                skipped += 1
+                continue
+
+            _delete_by_path(conn, abs_path)
+
+            section_rows = _insert_sections(conn, sections, bodies)
+            section_rows.sort(key=lambda r: r[1].start_line)
+            starts = [r[1].start_line for r in section_rows]
+            rel = rel_to_root(abs_path, docs_root)
+            tags = ",".join(Path(rel).parts[:3])
+
+            symbols_count += _insert_symbols(conn, symbols, section_rows, starts, tags, abs_path)
+            assets_count += _insert_assets(conn, assets, section_rows, starts, abs_path, docs_root)
+
+            conn.execute(
+                "INSERT OR REPLACE INTO files(path, mtime, digest, size) VALUES (?, ?, ?, ?)",
+                (abs_path, mtime, digest, size),
+            )
+            updated += 1
+            sections_count += len(sections)
 
     _rebuild_fts(conn)
     conn.commit()
@@ -2,25 +2,33 @@
 
 from __future__ import annotations
 
+import functools
 import hashlib
+import mmap
 import os
 import re
 from dataclasses import dataclass
 from pathlib import Path
 from typing import Dict, Iterable, List, Optional, Tuple
 
+try:
+    import blake3  # type: ignore
+except Exception:  # pragma: no cover
+    blake3 = None
+
 
 _HEADING_RE = re.compile(r"^(#{1,3})\s+(.+?)\s*$")
 _IMAGE_RE = re.compile(r"!\[([^\]]*)\]\(([^)]+)\)")
 
-_CLASS_RE = re.compile(r"^\s*(?:export\s+)?class\s+([A-Za-z_][\w]*)\b")
-_INTERFACE_RE = re.compile(r"^\s*(?:export\s+)?interface\s+([A-Za-z_][\w]*)\b")
-_ENUM_RE = re.compile(r"^\s*(?:export\s+)?enum\s+([A-Za-z_][\w]*)\b")
-_FUNCTION_RE = re.compile(r"^\s*(?:export\s+)?function\s+([A-Za-z_][\w]*)\b")
-_STRUCT_RE = re.compile(r"^\s*struct\s+([A-Za-z_][\w]*)\b")
+# One alternation for all declaration kinds; the matched keyword is the kind.
+_SYMBOL_RE = re.compile(
+    r"^\s*(?:(?:export\s+)?(?P<kind>class|interface|enum|function)|struct)\s+(?P<name>[A-Za-z_][\w]*)\b"
+)
 _COMPONENT_DECORATOR_RE = re.compile(r"^\s*@Component\b")
 
-_CALL_LIKE_RE = re.compile(r"\b([A-Za-z_][\w]*)\s*\(")
+# Names shorter than 3 characters are never useful; `{2,}` rejects them in the
+# automaton.
+_CALL_LIKE_RE = re.compile(r"\b([A-Za-z_]\w{2,})\s*\(")
 _CALL_LIKE_STOPWORDS = {
     "if",
     "for",
@@ -65,6 +73,13 @@ class Asset:
 
 
 def load_config(path: str) -> Dict:
+    # Cached per (path, mtime) so repeated calls in one process skip YAML
+    # parsing but still pick up edits to the file.
+    return _load_config(os.path.abspath(path), os.path.getmtime(path))
+
+
+@functools.lru_cache(maxsize=8)
+def _load_config(path: str, mtime: float) -> Dict:
     try:
         import yaml  # type: ignore
     except Exception as exc:  # pragma: no cover
@@ -79,122 +94,133 @@ def norm_path(path: str) -> str:
     return str(Path(path).resolve())
 
 
-def file_sha1(path: str) -> str:
-    h = hashlib.sha1()
+def file_digest(path: str) -> str:
+    # BLAKE3 when installed, otherwise SHA-256 (hardware-accelerated in OpenSSL).
+    h = blake3.blake3() if blake3 is not None else hashlib.sha256()
     with open(path, "rb") as f:
-        for chunk in iter(lambda: f.read(8192), b""):
-            h.update(chunk)
+        if os.fstat(f.fileno()).st_size == 0:
+            return h.hexdigest()
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            h.update(mm)
     return h.hexdigest()
 
 
 def read_lines(path: str) -> List[str]:
-    with open(path, "r", encoding="utf-8") as f:
-        return f.read().splitlines()
+    # Decode straight from the mapping: skips the text-mode reader's
+    # incremental decoder and newline translation (splitlines covers \r\n).
+    with open(path, "rb") as f:
+        if os.fstat(f.fileno()).st_size == 0:
+            return []
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            return str(mm, "utf-8").splitlines()
+
+
+def _is_excluded(rel: str, exclude_scopes: Iterable[str]) -> bool:
+    return any(rel.startswith(ex + "/") or rel == ex for ex in exclude_scopes)
+
+
+def _walk(path: str, rel: str, exclude_scopes: set, text_exts: set) -> Iterable[str]:
+    # Excluded directories are pruned before descending; like rglob, directory
+    # symlinks are not followed and unreadable directories are skipped.
+    try:
+        with os.scandir(path) as it:
+            entries = list(it)
+    except PermissionError:
+        return
+    for entry in entries:
+        entry_rel = f"{rel}/{entry.name}" if rel else entry.name
+        if _is_excluded(entry_rel, exclude_scopes):
+            continue
+        if entry.is_dir(follow_symlinks=False):
+            yield from _walk(entry.path, entry_rel, exclude_scopes, text_exts)
+        elif os.path.splitext(entry.name)[1].lower() in text_exts and entry.is_file():
+            yield os.path.realpath(entry.path)
 
 
 def iter_text_files(config: Dict) -> Iterable[str]:
     root = Path(config["docs_root"])
-    include_scopes = [root / p for p in config.get("include_scopes", [])]
     exclude_scopes = set(config.get("exclude_scopes", []))
     text_exts = set(config.get("text_extensions", []))
 
-    for scope in include_scopes:
-        if not scope.exists():
+    for scope in config.get("include_scopes", []):
+        scope_path = root / scope
+        if not scope_path.is_dir():
+            continue
+        # A scope of "." or "" is the docs root itself: walk it with no prefix
+        # so entry paths compare cleanly against exclude_scopes.
+        rel = scope_path.relative_to(root).as_posix()
+        if rel == ".":
+            rel = ""
+        elif _is_excluded(rel, exclude_scopes):
             continue
-        for path in scope.rglob("*"):
-            if not path.is_file():
-                continue
-            rel = path.relative_to(root).as_posix()
-            if any(rel.startswith(ex + "/") or rel == ex for ex in exclude_scopes):
-                continue
-            if path.suffix.lower() not in text_exts:
-                continue
-            yield str(path.resolve())
+        yield from _walk(str(scope_path), rel, exclude_scopes, text_exts)
+
+
+def _build_sections(path: str, headings: List[Tuple[int, int, str]], total_lines: int) -> List[Section]:
+    # A section runs until the next heading of the same or higher level; keep
+    # the still-open sections on a stack so spans resolve in a single pass.
+    sections: List[Section] = []
+    open_sections: List[Tuple[int, int]] = []
+    last_title: Dict[int, Optional[str]] = {1: None, 2: None, 3: None}
+    for line_no, level, title in headings:
+        while open_sections and open_sections[-1][1] >= level:
+            sections[open_sections.pop()[0]].end_line = line_no - 1
+        last_title[level] = title
+        open_sections.append((len(sections), level))
+        sections.append(
+            Section(
+                path=path,
+                h1=last_title[1],
+                h2=last_title[2],
+                h3=last_title[3],
+                start_line=line_no,
+                end_line=total_lines,
+            )
+        )
+    return sections
 
 
 def parse_sections(path: str, lines: List[str]) -> List[Section]:
     headings: List[Tuple[int, int, str]] = []
     for idx, line in enumerate(lines, start=1):
+        if not line.startswith("#"):
+            continue
         m = _HEADING_RE.match(line)
         if not m:
             continue
-        level = len(m.group(1))
-        title = m.group(2).strip()
-        headings.append((idx, level, title))
-
-    sections: List[Section] = []
-    if not headings:
-        return sections
-
-    for i, (line_no, level, title) in enumerate(headings):
-        end_line = len(lines)
-        for j in range(i + 1, len(headings)):
-            next_line, next_level, _ = headings[j]
-            if next_level <= level:
-                end_line = next_line - 1
-                break
-
-        h1 = h2 = h3 = None
-        for k in range(i, -1, -1):
-            prev_line, prev_level, prev_title = headings[k]
-            if prev_level == 1 and h1 is None:
-                h1 = prev_title
-            if prev_level == 2 and h2 is None:
-                h2 = prev_title
-            if prev_level == 3 and h3 is None:
-                h3 = prev_title
-        sections.append(Section(path=path, h1=h1, h2=h2, h3=h3, start_line=line_no, end_line=end_line))
-
-    return sections
-
-
-def extract_assets(lines: List[str]) -> List[Asset]:
-    assets: List[Asset] = []
-    for idx, line in enumerate(lines, start=1):
-        for m in _IMAGE_RE.finditer(line):
-            alt = m.group(1).strip()
-            rel = m.group(2).strip()
-            assets.append(Asset(alt=alt, rel_path=rel, line=idx))
-    return assets
+        headings.append((idx, len(m.group(1)), m.group(2).strip()))
+    return _build_sections(path, headings, len(lines))
 
 
-def extract_symbols(lines: List[str]) -> List[Symbol]:
+def parse_file_contents(path: str, lines: List[str]) -> Tuple[List[Section], List[Symbol], List[Asset]]:
+    """Collect sections, symbols and assets in one pass over ``lines``."""
+    headings: List[Tuple[int, int, str]] = []
     symbols: List[Symbol] = []
+    assets: List[Asset] = []
     pending_component = False
 
     for idx, line in enumerate(lines, start=1):
-        if _COMPONENT_DECORATOR_RE.match(line):
-            pending_component = True
-            continue
-
-        m = _CLASS_RE.match(line)
-        if m:
-            symbols.append(Symbol(name=m.group(1), kind="class", line=idx))
-            pending_component = False
-            continue
+        # Cheap substring checks first: only a few lines are headings or
+        # contain images, so most lines never enter those regexes.
+        if line.startswith("#"):
+            m = _HEADING_RE.match(line)
+            if m:
+                headings.append((idx, len(m.group(1)), m.group(2).strip()))
 
-        m = _INTERFACE_RE.match(line)
-        if m:
-            symbols.append(Symbol(name=m.group(1), kind="interface", line=idx))
-            pending_component = False
-            continue
-
-        m = _ENUM_RE.match(line)
-        if m:
-            symbols.append(Symbol(name=m.group(1), kind="enum", line=idx))
-            pending_component = False
-            continue
+        if "![" in line:
+            for m in _IMAGE_RE.finditer(line):
+                assets.append(Asset(alt=m.group(1).strip(), rel_path=m.group(2).strip(), line=idx))
 
-        m = _FUNCTION_RE.match(line)
-        if m:
-            symbols.append(Symbol(name=m.group(1), kind="function", line=idx))
-            pending_component = False
+        if _COMPONENT_DECORATOR_RE.match(line):
+            pending_component = True
             continue
 
-        m = _STRUCT_RE.match(line)
+        m = _SYMBOL_RE.match(line)
         if m:
-            kind = "component" if pending_component else "struct"
-            symbols.append(Symbol(name=m.group(1), kind=kind, line=idx))
+            kind = m.group("kind")
+            if kind is None:
+                kind = "component" if pending_component else "struct"
+            symbols.append(Symbol(name=m.group("name"), kind=kind, line=idx))
             pending_component = False
             continue
 
@@ -203,11 +229,9 @@ def extract_symbols(lines: List[str]) -> List[Symbol]:
                 name = m.group(1)
                 if name in _CALL_LIKE_STOPWORDS:
                     continue
-                if len(name) < 3:
-                    continue
                 symbols.append(Symbol(name=name, kind="call", line=idx))
 
-    return symbols
+    return _build_sections(path, headings, len(lines)), symbols, assets
 
 
 def extract_summary(lines: List[str], start_line: int, end_line: int) -> str: